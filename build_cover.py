@@ -5,9 +5,9 @@ build_cover.py
 One-shot cover builder + optional MP3 cover embedding + zipping.
 
 - Finds your art in the base folder (default /mnt/ai_data/BedtimeStories)
-- Resizes art to 3000x3000 (CPU-friendly, Pillow)
-- Embeds art as base64 data URI in an SVG, renders to JPG
-- Optionally embeds the cover.jpg into each MP3 in the story folder via ffmpeg
+- Resizes art to 3000x3000 (CPU-friendly; libvips or OpenCV if available, else Pillow)
+- References art by file:// URL in an SVG, renders to JPG (base64 data URI only for CLI fallbacks)
+- Optionally embeds the cover.jpg into each MP3 in the story folder (mutagen; ffmpeg fallback)
 - Deletes the original art (in base) and zips the story folder
 
 Usage:
@@ -20,20 +20,40 @@ Usage:
       [--base /mnt/ai_data/BedtimeStories]
       [--out-name friendly_dinosaurs_cover.jpg]
       [--no-embed]
+      [--no-sharpen]
+      [--mozjpeg]
 
 Deps:
-  sudo apt-get install ffmpeg                (for MP3 tagging)
-  pip install jinja2 pillow cairosvg         (cairosvg optional but preferred)
-  # or sudo apt-get install inkscape or librsvg2-bin for CLI fallbacks
+  sudo apt-get install ffmpeg                (MP3 tagging fallback when mutagen isn't installed)
+  pip install pillow cairosvg mutagen        (cairosvg optional but preferred)
+  pip install pybase64                       (optional, faster data-URI encoding for CLI fallbacks)
+  pip install pyvips                         (optional, faster upscale; needs libvips42)
+  pip install opencv-python-headless         (optional, used if pyvips is unavailable)
+  # or sudo apt-get install resvg (or cargo install resvg), inkscape or librsvg2-bin for CLI fallbacks
 """
-import argparse, os, sys, json, tempfile, shutil, subprocess, textwrap, base64, mimetypes
+from __future__ import annotations
+
+import argparse, os, sys, json, tempfile, shutil, subprocess, textwrap, base64, hashlib, time, html, zipfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from io import BytesIO
 from pathlib import Path
-from typing import Optional, List
-from jinja2 import Template
-from PIL import Image, ImageFilter
+from typing import TYPE_CHECKING, Callable, Dict, Optional, List, Union
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Heavy deps (PIL, cairosvg, pyvips) are imported where used, so --help and cache hits stay light
 
 # ---------- Defaults ----------
 DEFAULT_BASE = os.environ.get("STORY_BASE", "/mnt/ai_data/BedtimeStories")
+COVER_CACHE_DIR = ".cover_cache"     # under base, so it never lands in a story bundle
+COVER_CACHE_MAX_AGE = 30 * 86400     # seconds
+STORED_EXTS = {".mp3", ".jpg", ".jpeg", ".png", ".webp", ".zip"}   # zipped without recompression
+DATA_URI_JPEG_MIN_BYTES = 512 * 1024 # opaque PNGs at least this big are inlined as JPEG
+MIME_TYPES = {".png": "image/png", ".jpg": "image/jpeg", ".jpeg": "image/jpeg",
+              ".webp": "image/webp", ".svg": "image/svg+xml"}   # art formats find_art accepts (+ svg)
+NEAR_3000_TOLERANCE = 60             # px; art this close to 3000x3000 skips the resample
 PALETTES = {
     "warm":   {"BG1":"#1d2540","BG2":"#0c1326","TITLE_COLOR":"#F5F1E8","SUBTITLE_COLOR":"#E7DFCF","BADGE_BG":"#2A3358","BADGE_COLOR":"#F5F1E8"},
     "cool":   {"BG1":"#10222b","BG2":"#0a1720","TITLE_COLOR":"#EAF6FF","SUBTITLE_COLOR":"#D3EAF8","BADGE_BG":"#1c2f3a","BADGE_COLOR":"#EAF6FF"},
@@ -44,50 +64,39 @@ SVG_TEMPLATE = """\
 <svg width="3000" height="3000" viewBox="0 0 3000 3000" xmlns="http://www.w3.org/2000/svg">
   <defs>
     <linearGradient id="bggrad" x1="0" y1="0" x2="0" y2="1">
-      <stop offset="0%" stop-color="{{ BG1 }}"/>
-      <stop offset="100%" stop-color="{{ BG2 }}"/>
+      <stop offset="0%" stop-color="{BG1}"/>
+      <stop offset="100%" stop-color="{BG2}"/>
     </linearGradient>
     <style>
-      .title   { font: {{ TITLE_SIZE }}px sans-serif; fill: {{ TITLE_COLOR }}; font-weight: 700; }
-      .subtitle{ font: {{ SUB_SIZE }}px  sans-serif; fill: {{ SUBTITLE_COLOR }}; opacity: 0.92; }
-      .badge   { font: 64px  sans-serif; fill: {{ BADGE_COLOR }}; font-weight: 700; }
+      .title   {{ font: {TITLE_SIZE}px sans-serif; fill: {TITLE_COLOR}; font-weight: 700; }}
+      .subtitle{{ font: {SUB_SIZE}px  sans-serif; fill: {SUBTITLE_COLOR}; opacity: 0.92; }}
+      .badge   {{ font: 64px  sans-serif; fill: {BADGE_COLOR}; font-weight: 700; }}
     </style>
   </defs>
 
   <rect x="0" y="0" width="3000" height="3000" fill="url(#bggrad)"/>
-
-  {% if ART_DATA %}
+{ART_BLOCK}
+  <!-- Text block -->
+  <g transform="translate(150, {TEXT_BASE_Y})">
+{TITLE_BLOCK}{SUBTITLE_BLOCK}  </g>
+{BADGE_BLOCK}</svg>
+"""
+SVG_ART = """\
   <image x="350" y="500" width="2300" height="1500"
          preserveAspectRatio="xMidYMid meet"
-         href="{{ ART_DATA }}" opacity="0.96"/>
-  {% endif %}
-
-  <!-- Text block -->
-  <g transform="translate(150, {{ TEXT_BASE_Y }})">
-    {% if TITLE_LINES %}
-    <text class="title">
-      {% for line in TITLE_LINES -%}
-        <tspan x="0" dy="{{ 0 if loop.first else TITLE_LINE_DY }}">{{ line }}</tspan>
-      {%- endfor %}
-    </text>
-    {% endif %}
-
-    {% if SUBTITLE_LINES %}
-      <text class="subtitle" y="{{ SUBTITLE_OFFSET_Y }}">
-        {% for line in SUBTITLE_LINES -%}
-          <tspan x="0" dy="{{ 0 if loop.first else SUB_LINE_DY }}">{{ line }}</tspan>
-        {%- endfor %}
-      </text>
-    {% endif %}
-  </g>
-
-  {% if BADGE %}
+         href="{ART_DATA}" opacity="0.96"/>
+"""
+SVG_TITLE = """\
+    <text class="title">{TSPANS}</text>
+"""
+SVG_SUBTITLE = """\
+    <text class="subtitle" y="{SUBTITLE_OFFSET_Y}">{TSPANS}</text>
+"""
+SVG_BADGE = """\
   <g transform="translate(150, 200)">
-    <rect x="0" y="0" width="1200" height="150" rx="20" fill="{{ BADGE_BG }}" opacity="0.9"/>
-    <text class="badge" x="40" y="100">{{ BADGE }}</text>
+    <rect x="0" y="0" width="1200" height="150" rx="20" fill="{BADGE_BG}" opacity="0.9"/>
+    <text class="badge" x="40" y="100">{BADGE}</text>
   </g>
-  {% endif %}
-</svg>
 """
 
 # ---------- Helpers ----------
@@ -125,17 +134,172 @@ def find_art(base: Path, safe: str, explicit_name: Optional[str]) -> Path:
                 return cand
     raise FileNotFoundError(f"No art found in {base} for '{safe}' (expected '{safe}_art.(png|jpg|jpeg|webp)' or '{safe}.*')")
 
-def upscale_to_3000(src: Path) -> Path:
-    """Resize to 3000x3000 with LANCZOS + mild Unsharp; returns temp PNG if scaled, else original path."""
+def art_digest(art_src: Path) -> str:
+    key = hashlib.blake2b(digest_size=16)
+    with art_src.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            key.update(chunk)
+    return key.hexdigest()
+
+def cover_cache_key(safe: str, pal: dict, title_lines: List[str], subtitle_lines: List[str],
+                    badge: str, mozjpeg: bool, sharpen: bool) -> str:
+    """Hash of the story and every option that affects its cover; the art hash is stored beside the entry.
+
+    Keying without the art lets a re-run (e.g. after an MP3 re-tag) hit the cache even though
+    the source art was deleted at the end of the first run.
+    """
+    key = hashlib.blake2b(digest_size=16)
+    key.update(json.dumps(
+        [safe, pal, title_lines, subtitle_lines, badge, mozjpeg, sharpen], sort_keys=True
+    ).encode("utf-8"))
+    return key.hexdigest()
+
+def cached_cover(cache_dir: Path, key: str, art_hash: Optional[str]) -> Optional[Path]:
+    """Cached JPG for `key`, if present and rendered from `art_hash` (any art when the art is gone)."""
+    jpg, art = cache_dir / f"{key}.jpg", cache_dir / f"{key}.art"
+    try:
+        if jpg.is_file() and (art_hash is None or art.read_text().strip() == art_hash):
+            os.utime(jpg)
+            os.utime(art)
+            return jpg
+    except OSError:
+        pass
+    return None
+
+def store_cover_cache(cache_dir: Path, key: str, art_hash: str, cover: Path):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(cover, cache_dir / f"{key}.jpg")
+    (cache_dir / f"{key}.art").write_text(art_hash + "\n")
+
+def prune_cover_cache(cache_dir: Path, max_age: float = COVER_CACHE_MAX_AGE):
+    if not cache_dir.is_dir():
+        return
+    cutoff = time.time() - max_age
+    for p in cache_dir.glob("*.*"):
+        try:
+            if p.suffix in (".jpg", ".art") and p.stat().st_mtime < cutoff:
+                p.unlink()
+        except Exception:
+            pass
+
+def _near_3000(w: int, h: int) -> bool:
+    return abs(w - 3000) <= NEAR_3000_TOLERANCE and abs(h - 3000) <= NEAR_3000_TOLERANCE
+
+def _upscale_vips(src: Path, sharpen: bool = True) -> Optional[Path]:
+    """libvips resize + unsharp (tiled, multi-threaded); returns temp PNG, src if already ~3000x3000, None if pyvips unavailable."""
+    os.environ.setdefault("VIPS_CONCURRENCY", str(os.cpu_count() or 1))
+    try:
+        import pyvips
+    except Exception:
+        return None
+    tmp = None
+    try:
+        im = pyvips.Image.new_from_file(str(src), access="sequential")
+        if _near_3000(im.width, im.height):
+            return src
+        upscaling = im.width < 3000 or im.height < 3000
+        if im.interpretation != "srgb" or im.format != "uchar":
+            im = im.colourspace("srgb")
+        has_alpha = im.hasalpha()
+        if has_alpha:
+            im = im.premultiply()   # keep transparent pixels' hidden colour out of the edges
+        im = im.resize(3000 / im.width, vscale=3000 / im.height, kernel="lanczos3")
+        if sharpen and upscaling:
+            # Same unsharp as the Pillow path: out = im + 0.6 * (im - blur)
+            im = im * 1.6 - im.gaussblur(0.6) * 0.6
+        if has_alpha:
+            im = im.unpremultiply()
+        im = im.cast("uchar")
+        tmp = Path(tempfile.mkstemp(suffix=".png")[1])
+        im.pngsave(str(tmp), compression=1)
+        return tmp
+    except pyvips.Error as e:
+        print(f"⚠️  libvips upscale failed, using Pillow: {e}", file=sys.stderr)
+        if tmp is not None:
+            try: tmp.unlink()
+            except Exception: pass
+        return None
+
+def _upscale_cv2(src: Path, sharpen: bool = True) -> Optional[Path]:
+    """OpenCV LANCZOS4 resize + unsharp (SIMD, multi-threaded); same contract as _upscale_vips."""
+    try:
+        import cv2
+        import numpy as np
+    except Exception:
+        return None
+    cv2.setNumThreads(os.cpu_count() or 1)
+    tmp = None
+    try:
+        arr = cv2.imread(str(src), cv2.IMREAD_UNCHANGED)
+        if arr is None:
+            return None
+        h, w = arr.shape[:2]
+        if _near_3000(w, h):
+            return src
+        upscaling = w < 3000 or h < 3000
+        if arr.dtype != np.uint8:
+            arr = (arr / 257).astype(np.uint8)
+        if arr.ndim == 2:
+            arr = cv2.cvtColor(arr, cv2.COLOR_GRAY2BGR)
+        has_alpha = arr.ndim == 3 and arr.shape[2] == 4
+        if has_alpha:
+            # Premultiply so the hidden colour of transparent pixels can't bleed into edges
+            arr = arr.astype(np.float32)
+            arr[..., :3] *= arr[..., 3:] / 255.0
+        if min(w, h) >= 6000:
+            arr = cv2.resize(arr, (w // 2, h // 2), interpolation=cv2.INTER_AREA)
+        up = cv2.resize(arr, (3000, 3000), interpolation=cv2.INTER_LANCZOS4)
+        if sharpen and upscaling:
+            up = cv2.addWeighted(up, 1.6, cv2.GaussianBlur(up, (0, 0), 0.6), -0.6, 0)
+        if has_alpha:
+            alpha = np.clip(up[..., 3:], 0, 255)
+            up[..., :3] = np.where(alpha > 0, up[..., :3] * 255.0 / np.maximum(alpha, 1e-3), 0)
+            up = np.clip(up, 0, 255).round().astype(np.uint8)
+        tmp = Path(tempfile.mkstemp(suffix=".png")[1])
+        if not cv2.imwrite(str(tmp), up, [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+            raise cv2.error("imwrite failed")
+        return tmp
+    except cv2.error as e:
+        print(f"⚠️  OpenCV upscale failed, using Pillow: {e}", file=sys.stderr)
+        if tmp is not None:
+            try: tmp.unlink()
+            except Exception: pass
+        return None
+
+def _is_pillow_simd() -> bool:
+    """Pillow-SIMD releases are versioned X.Y.Z.postN."""
+    import PIL
+    return ".post" in PIL.__version__
+
+def upscale_to_3000(src: Path, sharpen: bool = True) -> Path:
+    """Resize to 3000x3000 with LANCZOS (+ mild Unsharp when upscaling); returns temp PNG if scaled, else original path.
+
+    Art within NEAR_3000_TOLERANCE px of 3000x3000 is passed through untouched.
+    Backends in order: libvips, OpenCV, Pillow.
+    """
+    for backend in (_upscale_vips, _upscale_cv2):
+        out = backend(src, sharpen=sharpen)
+        if out is not None:
+            return out
+    from PIL import Image, ImageFilter
     with Image.open(src) as im:
-        im = im.convert("RGBA")
         w, h = im.size
-        if (w, h) == (3000, 3000):
+        if _near_3000(w, h):
             return src
+        if not _is_pillow_simd():
+            print("ℹ️  Plain Pillow detected; Pillow-SIMD resizes several times faster (see README).",
+                  file=sys.stderr)
+        upscaling = w < 3000 or h < 3000
+        # Only carry an alpha band if the art has one: RGB is 3/4 the bytes through resize + unsharp
+        has_alpha = "A" in im.getbands() or "transparency" in im.info
+        im = im.convert("RGBA" if has_alpha else "RGB")
+        if min(w, h) >= 6000:
+            im = im.reduce(2)   # exact 2x2 box pre-shrink; LANCZOS then works on 1/4 the pixels
         tmp = Path(tempfile.mkstemp(suffix=".png")[1])
         up = im.resize((3000, 3000), resample=Image.LANCZOS)
-        up = up.filter(ImageFilter.UnsharpMask(radius=0.6, percent=60, threshold=2))
-        up.save(tmp, "PNG")
+        if sharpen and upscaling:
+            up = up.filter(ImageFilter.UnsharpMask(radius=0.6, percent=60, threshold=2))
+        up.save(tmp, "PNG", compress_level=1)   # short-lived temp; deflate effort is wasted
         return tmp
 
 def wrap_lines(text: str, width: int, max_lines: int) -> List[str]:
@@ -149,69 +313,233 @@ def wrap_lines(text: str, width: int, max_lines: int) -> List[str]:
         return keep
     return lines
 
+def _png_as_jpeg(path: Path) -> Optional[bytes]:
+    """Re-encode an opaque PNG as quality-95 JPEG (~10x smaller to base64 + parse); None if alpha matters."""
+    from PIL import Image
+    with Image.open(path) as im:
+        if "A" in im.getbands() or "transparency" in im.info:
+            alpha = im.convert("RGBA").getchannel("A")
+            if alpha.getextrema()[0] < 255:
+                return None
+        buf = BytesIO()
+        im.convert("RGB").save(buf, "JPEG", quality=95)
+        return buf.getvalue()
+
+def _b64encode(data: bytes) -> str:
+    """SIMD base64 via pybase64 when installed; stdlib otherwise."""
+    try:
+        import pybase64
+    except ImportError:
+        return base64.b64encode(data).decode("ascii")
+    return pybase64.b64encode_as_string(data)
+
 def file_to_data_uri(path: Path) -> str:
-    mime, _ = mimetypes.guess_type(str(path))
-    if not mime:
-        # Prefer PNG if we created a temp PNG; else fallback generic
-        mime = "image/png" if path.suffix.lower() == ".png" else "application/octet-stream"
+    if path.suffix.lower() == ".png" and path.stat().st_size >= DATA_URI_JPEG_MIN_BYTES:
+        jpeg = _png_as_jpeg(path)
+        if jpeg is not None:
+            return f"data:image/jpeg;base64,{_b64encode(jpeg)}"
+    mime = MIME_TYPES.get(path.suffix.lower(), "application/octet-stream")
     data = path.read_bytes()
-    b64 = base64.b64encode(data).decode("ascii")
+    b64 = _b64encode(data)
     return f"data:{mime};base64,{b64}"
 
-def svg_to_png(svg_bytes: bytes, out_png: Path):
-    """Render SVG to PNG. CairoSVG first; then Inkscape 1.x; then Inkscape 0.92; then rsvg-convert."""
-    try:
-        import cairosvg
-        cairosvg.svg2png(
-            bytestring=svg_bytes,
-            write_to=str(out_png),
-            output_width=3000,
-            output_height=3000,
-            url=Path(".").resolve().as_uri()
-        )
-        return
-    except Exception as e:
-        print(f"⚠️  CairoSVG render failed: {e}", file=sys.stderr)
-
+def _tspans(lines: List[str], dy: int) -> str:
+    # No whitespace between tspans: SVG would render it as a leading space on the next line
+    return "".join(
+        f'<tspan x="0" dy="{0 if i == 0 else dy}">{html.escape(line)}</tspan>'
+        for i, line in enumerate(lines)
+    )
+
+def render_svg_template(art_href: str, title_lines: List[str], subtitle_lines: List[str], badge: str,
+                        pal: dict, **layout) -> str:
+    """Fill SVG_TEMPLATE; all text and palette values are XML-escaped."""
+    pal = {k: html.escape(str(v)) for k, v in pal.items()}
+    art = SVG_ART.format(ART_DATA=html.escape(art_href)) if art_href else ""
+    title = SVG_TITLE.format(TSPANS=_tspans(title_lines, layout["TITLE_LINE_DY"])) if title_lines else ""
+    subtitle = SVG_SUBTITLE.format(
+        SUBTITLE_OFFSET_Y=layout["SUBTITLE_OFFSET_Y"],
+        TSPANS=_tspans(subtitle_lines, layout["SUB_LINE_DY"]),
+    ) if subtitle_lines else ""
+    badge_block = SVG_BADGE.format(BADGE=html.escape(badge), BADGE_BG=pal["BADGE_BG"]) if badge else ""
+    return SVG_TEMPLATE.format_map({
+        **pal, **layout,
+        "ART_BLOCK": art, "TITLE_BLOCK": title, "SUBTITLE_BLOCK": subtitle, "BADGE_BLOCK": badge_block,
+    })
+
+def _local_fetch(url: str, resource_type: str) -> bytes:
+    """CairoSVG url_fetcher: allow data: and file: URLs only (default blocks file:, unsafe=True allows XXE)."""
+    if url.startswith(("data:", "file:")):
+        from urllib.request import urlopen
+        with urlopen(url) as r:
+            return r.read()
+    return b'<svg width="1" height="1"></svg>'
+
+def _cairosvg_render(svg_bytes: bytes, base_url: Optional[str]) -> Image.Image:
+    """Draw with CairoSVG and wrap the cairo surface buffer directly (no PNG encode/decode)."""
+    from cairosvg.parser import Tree
+    from cairosvg.surface import PNGSurface
+    from PIL import Image
+    tree = Tree(bytestring=svg_bytes, url=base_url or Path(".").resolve().as_uri(),
+                url_fetcher=_local_fetch)
+    surface = PNGSurface(tree, None, 96, output_width=3000, output_height=3000)
+    cs = surface.cairo
+    cs.flush()
+    # cairo ARGB32 is premultiplied, native-endian → BGRa byte order on little-endian hosts
+    im = Image.frombuffer("RGBA", (cs.get_width(), cs.get_height()), cs.get_data(),
+                          "raw", "BGRa", cs.get_stride(), 1).convert("RGB")
+    surface.finish()
+    return im
+
+def _resvg_to_png(resvg: str, svg_bytes: bytes, out_png: Path):
+    subprocess.run(
+        [resvg, "-w", "3000", "-h", "3000", "-", str(out_png)],
+        input=svg_bytes, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def _inkscape092_to_png(inkscape: str, svg_bytes: bytes, out_png: Path):
+    """Inkscape 0.92 has no --pipe, so it still needs the SVG on disk."""
     tmp_svg = Path(tempfile.mkstemp(suffix=".svg")[1])
     tmp_svg.write_bytes(svg_bytes)
     try:
-        inkscape = shutil.which("inkscape")
-        if inkscape:
-            try:
-                subprocess.run(
-                    [inkscape, str(tmp_svg),
-                     "--export-type=png",
-                     f"--export-filename={out_png}",
-                     "--export-width=3000",
-                     "--export-height=3000"],
-                    check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-                )
-                return
-            except subprocess.CalledProcessError:
-                subprocess.run(
-                    [inkscape, str(tmp_svg),
-                     f"--export-png={out_png}",
-                     "-w", "3000", "-h", "3000"],
-                    check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-                )
-                return
-        rsvg = shutil.which("rsvg-convert")
-        if rsvg:
+        subprocess.run(
+            [inkscape, str(tmp_svg),
+             f"--export-png={out_png}",
+             "-w", "3000", "-h", "3000"],
+            check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+    finally:
+        try: tmp_svg.unlink()
+        except Exception: pass
+
+def _inkscape_to_png(inkscape: str, svg_bytes: bytes, out_png: Path):
+    """Inkscape 1.x via --pipe; falls back to the 0.92 CLI and remembers that for later calls.
+
+    Only an "unknown option" rejection of --pipe latches the fallback; other failures are raised.
+    """
+    if not _INKSCAPE_LEGACY.get(inkscape):
+        try:
             subprocess.run(
-                [rsvg, "-w", "3000", "-h", "3000", "-o", str(out_png), str(tmp_svg)],
-                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                [inkscape, "--pipe",
+                 "--export-type=png",
+                 f"--export-filename={out_png}",
+                 "--export-width=3000",
+                 "--export-height=3000"],
+                input=svg_bytes, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
             )
             return
-        raise RuntimeError("No renderer available. Install 'cairosvg' (pip) or 'inkscape' or 'librsvg2-bin'.")
+        except subprocess.CalledProcessError as e:
+            err = (e.stderr or b"").decode("utf-8", "replace").lower()
+            if "unknown option" not in err or "pipe" not in err:
+                raise
+            _INKSCAPE_LEGACY[inkscape] = True
+    _inkscape092_to_png(inkscape, svg_bytes, out_png)
+
+def _rsvg_to_png(rsvg: str, svg_bytes: bytes, out_png: Path):
+    subprocess.run(
+        [rsvg, "-w", "3000", "-h", "3000", "-o", str(out_png), "-"],
+        input=svg_bytes, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+# CLI renderers in preference order: name -> (executable, render(exe, svg_bytes, out_png))
+_CLI_RENDERERS = {
+    "resvg": ("resvg", _resvg_to_png),
+    "inkscape": ("inkscape", _inkscape_to_png),
+    "rsvg": ("rsvg-convert", _rsvg_to_png),
+}
+_RENDERERS: Optional[Dict[str, Optional[str]]] = None   # name -> executable (None for cairosvg)
+_INKSCAPE_LEGACY: Dict[str, bool] = {}
+
+def _detect_renderers() -> Dict[str, Optional[str]]:
+    """Probe cairosvg and the CLI renderers once per process; preference order is kept."""
+    global _RENDERERS
+    if _RENDERERS is None:
+        found: Dict[str, Optional[str]] = {}
+        try:
+            import cairosvg  # noqa: F401
+            found["cairosvg"] = None
+        except Exception as e:
+            print(f"⚠️  CairoSVG unavailable: {e}", file=sys.stderr)
+        for name, (exe, _) in _CLI_RENDERERS.items():
+            path = shutil.which(exe)
+            if path:
+                found[name] = path
+        _RENDERERS = found
+    return _RENDERERS
+
+def svg_to_png(svg_bytes: bytes, base_url: Optional[str] = None,
+               inline_svg: Optional[Callable[[], bytes]] = None) -> Image.Image:
+    """Render SVG to a 3000x3000 RGB image. CairoSVG in memory first; then resvg, Inkscape, rsvg-convert via a temp PNG.
+
+    `inline_svg` lazily builds a self-contained SVG (art as data URI) for the CLI fallbacks,
+    so the base64 pass is only paid when CairoSVG can't render the file:// reference.
+    """
+    renderers = _detect_renderers()
+    if "cairosvg" in renderers:
+        try:
+            return _cairosvg_render(svg_bytes, base_url)
+        except Exception as e:
+            print(f"⚠️  CairoSVG render failed: {e}", file=sys.stderr)
+
+    cli = [(name, exe) for name, exe in renderers.items() if name in _CLI_RENDERERS]
+    if not cli:
+        raise RuntimeError("No renderer available. Install 'cairosvg' (pip) or 'resvg' or 'inkscape' or 'librsvg2-bin'.")
+
+    from PIL import Image
+    if inline_svg is not None:
+        svg_bytes = inline_svg()
+    out_png = Path(tempfile.mkstemp(suffix=".png")[1])
+    try:
+        for i, (name, exe) in enumerate(cli):
+            try:
+                _CLI_RENDERERS[name][1](exe, svg_bytes, out_png)
+                break
+            except subprocess.CalledProcessError as e:
+                if i == len(cli) - 1:
+                    raise
+                print(f"⚠️  {name} render failed: {e}", file=sys.stderr)
+        with Image.open(out_png) as im:
+            return im.convert("RGB")
     finally:
-        try: tmp_svg.unlink()
+        try: out_png.unlink()
         except Exception: pass
 
-def png_to_jpg(png_path: Path, jpg_path: Path, quality=92):
-    with Image.open(png_path) as im:
-        im = im.convert("RGB")
+def _cjpeg_save(im: Image.Image, jpg_path: Path, quality: int) -> bool:
+    """Encode via mozjpeg's cjpeg (PPM piped on stdin); False if cjpeg is missing or fails."""
+    cjpeg = shutil.which("cjpeg")
+    if not cjpeg:
+        print("⚠️  cjpeg (mozjpeg) not found; using Pillow JPEG encoder.", file=sys.stderr)
+        return False
+    buf = BytesIO()
+    im.save(buf, "PPM")
+    try:
+        subprocess.run(
+            [cjpeg, "-quality", str(quality), "-optimize", "-outfile", str(jpg_path)],
+            input=buf.getvalue(), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        return True
+    except subprocess.CalledProcessError:
+        print("⚠️  cjpeg failed; using Pillow JPEG encoder.", file=sys.stderr)
+        return False
+
+def _save_jpg(im: Image.Image, jpg_path: Path, quality: int, mozjpeg: bool) -> bool:
+    """Returns True if mozjpeg's cjpeg wrote the file, False if Pillow did."""
+    if mozjpeg and _cjpeg_save(im, jpg_path, quality):
+        return True
+    from PIL import features
+    if features.check_feature("libjpeg_turbo"):
+        # SIMD DCT; single Huffman pass instead of optimize's second pass
+        im.save(jpg_path, "JPEG", quality=quality, optimize=False, progressive=False, subsampling=2)
+    else:
         im.save(jpg_path, "JPEG", quality=quality, optimize=True)
+    return False
+
+def png_to_jpg(png: Union[Image.Image, Path], jpg_path: Path, quality=92, mozjpeg=False) -> bool:
+    """Save as JPEG; returns whether mozjpeg was actually used."""
+    from PIL import Image
+    if isinstance(png, Image.Image):
+        return _save_jpg(png if png.mode == "RGB" else png.convert("RGB"), jpg_path, quality, mozjpeg)
+    with Image.open(png) as im:
+        return _save_jpg(im.convert("RGB"), jpg_path, quality, mozjpeg)
 
 def _is_within(child: Path, parent: Path) -> bool:
     try:
@@ -230,46 +558,127 @@ def delete_source_art(art_src: Path, base: Path):
         print(f"⚠️  Could not delete art ({art_src}): {e}")
 
 def zip_story_folder(outdir: Path, safe: str) -> Path:
-    tmpdir = Path(tempfile.mkdtemp())
+    """Zip the story folder; already-compressed media is stored, text/metadata gets a fast deflate.
+
+    The archive is written next to its destination as `.part` and renamed into place,
+    so there is no cross-filesystem copy from a temp dir.
+    """
+    dest = outdir / f"{safe}.zip"
+    part = dest.with_name(dest.name + ".part")
     try:
-        base_name = tmpdir / safe
-        zip_path = shutil.make_archive(str(base_name), "zip", root_dir=str(outdir))
-        dest = outdir / f"{safe}.zip"
-        if dest.exists():
-            dest.unlink()
-        shutil.move(zip_path, dest)
-        print(f"📦 Created bundle: {dest}")
-        return dest
-    finally:
-        shutil.rmtree(tmpdir, ignore_errors=True)
+        with zipfile.ZipFile(part, "w", zipfile.ZIP_STORED, allowZip64=True) as z:
+            for path in sorted(outdir.rglob("*")):
+                if path in (dest, part) or not path.is_file():
+                    continue
+                arcname = path.relative_to(outdir).as_posix()
+                if path.suffix.lower() in STORED_EXTS:
+                    z.write(path, arcname)
+                else:
+                    z.write(path, arcname, compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+        os.replace(part, dest)
+    except BaseException:
+        try: part.unlink()
+        except Exception: pass
+        raise
+    print(f"📦 Created bundle: {dest}")
+    return dest
+
+def _embed_batch(batch: List[Path], cover_path: Path, ffmpeg: str) -> List[bool]:
+    """Tag every MP3 in `batch` with one ffmpeg run; on failure bisect so one bad file doesn't sink the rest."""
+    tmps = [f.with_name(f"_tmp_{f.name}") for f in batch]
+    cmd = [ffmpeg, "-y", "-i", str(cover_path)]
+    for f in batch:
+        cmd += ["-i", str(f)]
+    for i, tmp in enumerate(tmps, start=1):
+        cmd += [
+            "-map", f"{i}:a", "-map", "0:v",
+            "-map_metadata", str(i),   # keep each MP3's own ID3 tags (default would copy input 0, the cover)
+            "-c:a", "copy", "-c:v", "mjpeg",
+            "-disposition:v", "attached_pic",
+            "-f", "mp3", str(tmp)
+        ]
+    try:
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        for f, tmp in zip(batch, tmps):
+            tmp.replace(f)
+        return [True] * len(batch)
+    except subprocess.CalledProcessError:
+        for tmp in tmps:
+            if tmp.exists():
+                tmp.unlink()
+        if len(batch) == 1:
+            return [False]
+        mid = len(batch) // 2
+        return _embed_batch(batch[:mid], cover_path, ffmpeg) + _embed_batch(batch[mid:], cover_path, ffmpeg)
+
+def _embed_mutagen_one(f: Path, cover: bytes) -> bool:
+    from mutagen import MutagenError
+    from mutagen.id3 import APIC
+    from mutagen.mp3 import MP3
+    tmp = f.with_name(f"_tmp_{f.name}")
+    try:
+        audio = MP3(str(f))   # validates MPEG frames, like ffmpeg would
+        if audio.tags is None:
+            audio.add_tags()
+        tags = audio.tags
+        tags.delall("APIC")
+        tags.add(APIC(encoding=3, mime="image/jpeg", type=3, desc="Cover", data=cover))
+        # New tag into an empty temp file, then the audio after the old tag appended once
+        tags.save(str(tmp), v2_version=3)
+        with f.open("rb") as src, tmp.open("ab") as dst:
+            src.seek(tags.size)
+            shutil.copyfileobj(src, dst, 1 << 20)
+        shutil.copymode(f, tmp)
+        os.replace(tmp, f)
+        return True
+    except (MutagenError, OSError):
+        try: tmp.unlink()
+        except Exception: pass
+        return False
 
-def embed_cover_in_mp3s(folder: Path, cover_path: Path):
+def _embed_mutagen(mp3s: List[Path], cover_path: Path) -> Optional[List[bool]]:
+    """Replace the APIC frame in each MP3's ID3 tag (no ffmpeg, no re-mux); None if mutagen is missing.
+
+    Each file is rebuilt in a single pass: the new tag is written to a sibling temp file, the
+    audio from the end of the old tag is appended, and the result is os.replace()d over the
+    original. That is one read + write per chapter (mutagen's in-place save would shift the
+    audio whenever the cover outgrows the padding), and a crash leaves the chapter untouched.
+    """
+    try:
+        import mutagen.mp3  # noqa: F401
+    except ImportError:
+        return None
+    cover = cover_path.read_bytes()
+    with ThreadPoolExecutor(max_workers=min(len(mp3s), os.cpu_count() or 1)) as ex:
+        return list(ex.map(partial(_embed_mutagen_one, cover=cover), mp3s))
+
+def _embed_ffmpeg(mp3s: List[Path], cover_path: Path) -> Optional[List[bool]]:
     ffmpeg = shutil.which("ffmpeg")
     if not ffmpeg:
-        print("⚠️  ffmpeg not found; skipping MP3 art embed.", file=sys.stderr)
-        return
+        return None
+    # One ffmpeg per worker, each tagging a contiguous slice of the files
+    workers = min(len(mp3s), os.cpu_count() or 1)
+    size = -(-len(mp3s) // workers)
+    batches = [mp3s[i:i + size] for i in range(0, len(mp3s), size)]
+    with ThreadPoolExecutor(max_workers=len(batches)) as ex:
+        return [ok for oks in ex.map(partial(_embed_batch, cover_path=cover_path, ffmpeg=ffmpeg), batches)
+                for ok in oks]
+
+def embed_cover_in_mp3s(folder: Path, cover_path: Path):
     mp3s = sorted(folder.glob("*.mp3"))
     if not mp3s:
         print("ℹ️  No MP3 files to tag in", folder)
         return
-    for f in mp3s:
-        tmp = f.with_name(f"_tmp_{f.name}")
-        cmd = [
-            ffmpeg, "-y",
-            "-i", str(f),
-            "-i", str(cover_path),
-            "-map", "0:a", "-map", "1:v",
-            "-c:a", "copy", "-c:v", "mjpeg",
-            "-disposition:v", "attached_pic",
-            str(tmp)
-        ]
-        try:
-            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            tmp.replace(f)
+    results = _embed_mutagen(mp3s, cover_path)
+    if results is None:
+        results = _embed_ffmpeg(mp3s, cover_path)
+    if results is None:
+        print("⚠️  Neither mutagen nor ffmpeg found; skipping MP3 art embed.", file=sys.stderr)
+        return
+    for f, ok in zip(mp3s, results):
+        if ok:
             print(f"🎵 Embedded cover into {f.name}")
-        except subprocess.CalledProcessError:
-            if tmp.exists():
-                tmp.unlink()
+        else:
             print(f"⚠️  Failed to embed cover into {f.name}", file=sys.stderr)
 
 # ---------- Main ----------
@@ -284,6 +693,8 @@ def main():
     ap.add_argument("--base", default=DEFAULT_BASE, help=f"Base path (default {DEFAULT_BASE})")
     ap.add_argument("--out-name", default="", help="Override output filename (defaults to {safeTheme}_cover.jpg)")
     ap.add_argument("--no-embed", action="store_true", help="Skip embedding cover.jpg into MP3s")
+    ap.add_argument("--no-sharpen", action="store_true", help="Skip the unsharp mask after upscaling the art")
+    ap.add_argument("--mozjpeg", action="store_true", help="Encode the cover with mozjpeg's cjpeg (smaller, slower)")
     ap.add_argument("--title-width", type=int, default=22, help="Approx chars per title line (wrap)")
     ap.add_argument("--title-lines", type=int, default=2, help="Max title lines")
     ap.add_argument("--subtitle-width", type=int, default=38, help="Approx chars per subtitle line (wrap)")
@@ -313,39 +724,60 @@ def main():
     SUB_LINE_DY = 100
     SUBTITLE_OFFSET_Y = 160 + (TITLE_LINE_DY * (len(title_lines)-1 if len(title_lines)>0 else 0))
 
-    # Art → normalize size → embed as data URI
-    art_src = find_art(base, safe, args.art or None)
-    art_norm = upscale_to_3000(art_src)
-    art_data_uri = file_to_data_uri(Path(art_norm))
-
-    # Render SVG
-    svg = Template(SVG_TEMPLATE).render(
-        ART_DATA=art_data_uri,
-        TITLE_LINES=title_lines,
-        SUBTITLE_LINES=subtitle_lines,
-        BADGE=args.badge.strip(),
-        TEXT_BASE_Y=TEXT_BASE_Y,
-        TITLE_LINE_DY=TITLE_LINE_DY,
-        SUB_LINE_DY=SUB_LINE_DY,
-        SUBTITLE_OFFSET_Y=SUBTITLE_OFFSET_Y,
-        TITLE_SIZE=TITLE_SIZE,
-        SUB_SIZE=SUB_SIZE,
-        **pal,
-    ).encode("utf-8")
-
-    # SVG -> PNG -> JPG
-    tmp_png = Path(tempfile.mkstemp(suffix=".png")[1])
+    # Art → cache lookup → normalize size → reference by file:// URL
+    # The art may already be gone (deleted by a previous run); a cache hit doesn't need it.
     try:
-        svg_to_png(svg, tmp_png)
-        png_to_jpg(tmp_png, out_path, quality=92)
-    finally:
-        try: tmp_png.unlink()
-        except Exception: pass
-        if art_norm != art_src:
-            try: Path(art_norm).unlink()
-            except Exception: pass
-
-    print(f"✅ Cover written: {out_path}")
+        art_src: Optional[Path] = find_art(base, safe, args.art or None)
+    except FileNotFoundError as e:
+        art_src, art_missing = None, e
+    art_hash = art_digest(art_src) if art_src else None
+    sharpen = not args.no_sharpen
+    badge = args.badge.strip()
+    cache_dir = base / COVER_CACHE_DIR
+    prune_cover_cache(cache_dir)
+    # Key on the encoder that will actually run, so --mozjpeg without cjpeg matches Pillow output
+    mozjpeg = args.mozjpeg and shutil.which("cjpeg") is not None
+    hit = cached_cover(cache_dir, cover_cache_key(safe, pal, title_lines, subtitle_lines, badge, mozjpeg, sharpen),
+                       art_hash)
+    if hit:
+        shutil.copyfile(hit, out_path)
+        print(f"♻️  Cover unchanged; reused cached render: {out_path}")
+    elif art_src is None:
+        raise art_missing
+    else:
+        art_norm = upscale_to_3000(art_src, sharpen=sharpen)
+        art_url = Path(art_norm).resolve().as_uri()
+
+        # Render SVG
+        def render_svg(art_href: str) -> bytes:
+            return render_svg_template(
+                art_href, title_lines, subtitle_lines, badge, pal,
+                TEXT_BASE_Y=TEXT_BASE_Y,
+                TITLE_LINE_DY=TITLE_LINE_DY,
+                SUB_LINE_DY=SUB_LINE_DY,
+                SUBTITLE_OFFSET_Y=SUBTITLE_OFFSET_Y,
+                TITLE_SIZE=TITLE_SIZE,
+                SUB_SIZE=SUB_SIZE,
+            ).encode("utf-8")
+        svg = render_svg(art_url)
+
+        # SVG -> raster -> JPG
+        try:
+            cover = svg_to_png(svg,
+                               base_url=Path(art_norm).parent.resolve().as_uri() + "/",
+                               inline_svg=lambda: render_svg(file_to_data_uri(Path(art_norm))))
+            used_mozjpeg = png_to_jpg(cover, out_path, quality=92, mozjpeg=mozjpeg)
+        finally:
+            if art_norm != art_src:
+                try: Path(art_norm).unlink()
+                except Exception: pass
+
+        print(f"✅ Cover written: {out_path}")
+        try:
+            key = cover_cache_key(safe, pal, title_lines, subtitle_lines, badge, used_mozjpeg, sharpen)
+            store_cover_cache(cache_dir, key, art_hash, out_path)
+        except Exception as e:
+            print(f"⚠️  Could not cache cover: {e}", file=sys.stderr)
 
     # Embed into MP3s
     if not args.no_embed:
@@ -353,7 +785,8 @@ def main():
 
     # Cleanup + zip
     try:
-        delete_source_art(art_src, base)
+        if art_src:
+            delete_source_art(art_src, base)
     except Exception as e:
         print(f"⚠️  delete_source_art failed: {e}")
     try: